@@ -1,173 +1,609 @@
 import asyncio
+import atexit
+import codecs
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import io
+import json
 import logging
+import re
 import sqlite3
-from urllib.parse import urljoin
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from urllib.parse import urljoin, urlsplit
 from urllib.robotparser import RobotFileParser
 import aiohttp
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from playwright.async_api import async_playwright
 import feedparser
 import streamlit as st
+from tenacity import before_sleep_log, retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 import pandas as pd
-import plotly.express as px
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Selectors used against lexbor trees
+_HEADING_SEL = 'h1,h2,h3'
+_DESC_SEL = 'meta[name=description]'
+_LINK_SEL = 'a[href]'
+_NEXT_SEL = 'a[rel~=next]'
+_SCRIPT_SEL = 'script'
+_SPA_ROOT_SEL = 'div#root, div#app'
+_FEED_LINK_SEL = 'link[rel~=alternate][href]'
+_FEED_TYPES = frozenset({"application/rss+xml", "application/atom+xml"})
+
+@st.cache_resource
+def _shared():
+    """Process-wide crawler state, kept across Streamlit reruns of this script.
+
+    The aiohttp session and Playwright browser are created lazily on the
+    running event loop and remembered together with that loop.
+    """
+    return SimpleNamespace(
+        session=None,
+        session_loop=None,
+        playwright=None,
+        browser=None,
+        browser_loop=None,
+        # Serializes browser launches so concurrent first checks start only one Chromium
+        browser_lock=asyncio.Lock(),
+        # Outbound concurrency limits for HTTP requests and Playwright pages
+        http_sem=asyncio.Semaphore(20),
+        pw_sem=asyncio.Semaphore(2),
+        # Per-host robots.txt crawl delays and the earliest time.monotonic() the next request may start
+        host_delay={},
+        host_next_slot={},
+        # Parsed robots.txt per host as (parser or None if missing, time.monotonic() when fetched)
+        robots={}
+    )
+
+async def _get_session():
+    """Return the shared aiohttp session, creating it on first use."""
+    shared = _shared()
+    loop = asyncio.get_running_loop()
+    if shared.session is None or shared.session.closed or shared.session_loop is not loop:
+        shared.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=10),
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=600, keepalive_timeout=60)
+        )
+        shared.session_loop = loop
+    return shared.session
+
+async def _throttle(url):
+    """Wait until url's host may be requested again under its crawl delay."""
+    shared = _shared()
+    host = urlsplit(url).netloc
+    delay = shared.host_delay.get(host)
+    if not delay:
+        return
+    now = time.monotonic()
+    slot = max(now, shared.host_next_slot.get(host, now))
+    shared.host_next_slot[host] = slot + delay
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+@contextlib.asynccontextmanager
+async def _request(method, url, **kwargs):
+    """Issue a rate-limited request through the shared session."""
+    await _throttle(url)
+    async with _shared().http_sem:
+        session = await _get_session()
+        async with session.request(method, url, **kwargs) as response:
+            yield response
+
+async def _get_browser():
+    """Return the shared Playwright browser, launching it on first use.
+
+    Each check opens its own browser context on it.
+    """
+    shared = _shared()
+    loop = asyncio.get_running_loop()
+    async with shared.browser_lock:
+        if shared.browser is None or shared.browser_loop is not loop or not shared.browser.is_connected():
+            if shared.playwright is not None and shared.browser_loop is loop:
+                await shared.playwright.stop()
+            shared.browser = None
+            shared.playwright = await async_playwright().start()
+            shared.browser_loop = loop
+            shared.browser = await shared.playwright.chromium.launch(headless=True, args=['--disable-dev-shm-usage', '--no-sandbox'])
+        return shared.browser
+
+async def close_resources():
+    """Close the shared aiohttp session and Playwright browser."""
+    shared = _shared()
+    if shared.session is not None and not shared.session.closed:
+        await shared.session.close()
+    shared.session = None
+    shared.session_loop = None
+    if shared.browser is not None and shared.browser.is_connected():
+        await shared.browser.close()
+    if shared.playwright is not None:
+        await shared.playwright.stop()
+    shared.playwright = None
+    shared.browser = None
+    shared.browser_loop = None
+
+# Seconds a stored analysis of the same URL is reused instead of crawling again
+CACHE_TTL = 600
+
+# Seconds a host's parsed robots.txt is reused before it is downloaded again
+ROBOTS_TTL = 3600
+
+# Longest robots.txt Crawl-delay enforced between requests to one host, in seconds
+MAX_CRAWL_DELAY = 10
+
+# Hosts asking for a longer delay than this skip the optional feed and API probes
+PROBE_DELAY_LIMIT = 2
+
+# Seconds the dashboard waits for one analysis before giving up
+ANALYSIS_TIMEOUT = 120
+
 # Database setup
+_DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+"""
+
+@st.cache_resource
+def get_db():
+    """Return the shared SQLite connection, opened and tuned once per process."""
+    conn = sqlite3.connect('crawled_data.db', check_same_thread=False)
+    conn.executescript(_DB_PRAGMAS)
+    return conn
+
 def init_db():
-    conn = sqlite3.connect('crawled_data.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS crawl_results (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        url TEXT,
-        timestamp TEXT,
-        titles TEXT,
-        descriptions TEXT,
-        links TEXT,
-        can_crawl BOOLEAN,
-        crawl_delay TEXT,
-        sitemap_urls TEXT,
-        is_js_heavy BOOLEAN,
-        api_detected BOOLEAN,
-        rss_feeds TEXT
-    )''')
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS crawl_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT,
+            timestamp TEXT,
+            titles TEXT,
+            descriptions TEXT,
+            links TEXT,
+            can_crawl BOOLEAN,
+            crawl_delay TEXT,
+            sitemap_urls TEXT,
+            is_js_heavy BOOLEAN,
+            api_detected BOOLEAN,
+            rss_feeds TEXT,
+            error TEXT,
+            disallowed_paths TEXT,
+            next_page TEXT,
+            robots_error TEXT
+        )''')
+        # Databases created by earlier versions lack the columns added since
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(crawl_results)")}
+        for column in ("error", "disallowed_paths", "next_page", "robots_error"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE crawl_results ADD COLUMN {column} TEXT")
+        # Serves both lookups by url and the newest-row lookup of load_recent
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_crawl_url_ts ON crawl_results(url, timestamp DESC)")
+
+def _join(base, href):
+    """urljoin against a pre-split base URL, without re-parsing it for absolute and root-relative hrefs."""
+    if href.startswith(("http://", "https://")):
+        return href
+    if base.netloc and href.startswith("/") and not href.startswith("//") and "/." not in href:
+        return f"{base.scheme}://{base.netloc}{href}"
+    return urljoin(base.geturl(), href)
+
+@functools.lru_cache(maxsize=1024)
+def _parse_robots(robots_text):
+    """Parse robots.txt content, reusing the parser for identical files."""
+    parser = RobotFileParser()
+    parser.parse(robots_text.splitlines())
+    return parser
+
+def _disallowed_paths(parser):
+    """List the paths disallowed for all user agents ("*")."""
+    entry = parser.default_entry
+    if entry is None:
+        return []
+    return [line.path for line in entry.rulelines if not line.allowance]
+
+# A missing robots.txt is a valid answer, unlike a failed download
+_NO_ROBOTS = "No robots.txt found"
+
+async def _host_robots(base):
+    """Return the parsed robots.txt for base's host, fetching it at most once per ROBOTS_TTL.
+
+    Returns None when the host serves no robots.txt; that answer is cached too.
+    """
+    robots = _shared().robots
+    cached = robots.get(base.netloc)
+    if cached is not None and time.monotonic() - cached[1] < ROBOTS_TTL:
+        return cached[0]
+    async with _request("GET", _join(base, "/robots.txt"), timeout=10) as response:
+        parser = _parse_robots(await response.text()) if response.status == 200 else None
+    robots.pop(base.netloc, None)
+    if len(robots) >= 1024:
+        # Evict the host fetched longest ago
+        del robots[next(iter(robots))]
+    robots[base.netloc] = (parser, time.monotonic())
+    return parser
 
 async def analyze_robots_txt(base_url):
     """Analyze robots.txt for crawlability rules."""
-    robots_url = urljoin(base_url, "/robots.txt")
-    parser = RobotFileParser()
-    parser.set_url(robots_url)
+    base = urlsplit(base_url)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(robots_url, timeout=10) as response:
-                if response.status == 200:
-                    parser.parse((await response.text()).splitlines())
-                    return {
-                        "can_crawl": parser.can_fetch("*", base_url),
-                        "crawl_delay": parser.crawl_delay("*") or "Not specified",
-                        "sitemap_urls": parser.site_maps() or ["None found"],
-                        "disallowed_paths": parser.disallow_all
-                    }
+        parser = await _host_robots(base)
     except Exception as e:
         logger.error(f"Failed to parse robots.txt: {e}")
         return {"error": f"Failed to parse robots.txt: {e}"}
-    return {"error": "No robots.txt found"}
+    if parser is None:
+        return {"error": _NO_ROBOTS}
+    delay = parser.crawl_delay("*")
+    if delay:
+        _shared().host_delay[base.netloc] = min(float(delay), MAX_CRAWL_DELAY)
+    return {
+        "can_crawl": parser.can_fetch("*", base_url),
+        "crawl_delay": delay or "Not specified",
+        "sitemap_urls": parser.site_maps() or ["None found"],
+        "disallowed_paths": _disallowed_paths(parser)
+    }
+
+# Only the start of a page is ever inspected, so bodies are read up to this many bytes
+_MAX_BODY_BYTES = 2_000_000
+
+async def _read_capped(response, limit=_MAX_BODY_BYTES):
+    """Read a response body in chunks, stopping once limit bytes have arrived."""
+    buffer = bytearray()
+    async for chunk in response.content.iter_chunked(65536):
+        buffer += chunk
+        if len(buffer) > limit:
+            break
+    return bytes(buffer[:limit])
+
+# Matches both <meta charset=...> and <meta http-equiv="Content-Type" content="...; charset=...">
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+
+def _sniff_charset(body):
+    """Return the charset a page declares in a <meta> tag within its first 2 KB, or None."""
+    match = _META_CHARSET.search(body[:2048])
+    return match.group(1).decode('ascii') if match else None
+
+def _decode_body(response, body):
+    """Decode a body with the charset from its headers or <meta> tag, falling back to UTF-8."""
+    encoding = response.charset or _sniff_charset(body) or 'utf-8'
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = 'utf-8'
+    return body.decode(encoding, errors='replace')
+
+def _is_transient(exc):
+    """Return True for fetch errors worth retrying; other 4xx responses and malformed URLs are permanent."""
+    if isinstance(exc, ValueError):
+        # aiohttp.InvalidURL is both a ClientError and a ValueError
+        return False
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or not 400 <= exc.status < 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_random_exponential(min=1, max=8),
+    retry=retry_if_exception(_is_transient),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+async def _fetch_static(url):
+    """Fetch the static HTML of a page with retry, returning (status, text, headers)."""
+    async with _request("GET", url, timeout=10) as response:
+        response.raise_for_status()
+        return response.status, _decode_body(response, await _read_capped(response)), response.headers
+
+def _first_unique(items, limit):
+    """Return up to limit distinct items in order, stopping as soon as enough are seen."""
+    seen = {}
+    for item in items:
+        seen[item] = None
+        if len(seen) >= limit:
+            break
+    return list(seen)
+
+def extract_content_from_html(url, html):
+    """Extract meaningful content and pagination from already fetched HTML."""
+    tree = LexborHTMLParser(html)
+    base = urlsplit(url)
+    anchors = tree.css(_LINK_SEL)
+    data = {
+        "titles": [node.text().strip() for node in tree.css(_HEADING_SEL)][:10],
+        "descriptions": [node.attributes.get("content") or "" for node in tree.css(_DESC_SEL)],
+        "links": _first_unique((_join(base, href) for href in (node.attributes.get("href") for node in anchors) if href), 50),
+        "next_page": None
+    }
+    next_page = next((node for node in anchors if node.text().strip() == "Next"), None)
+    if next_page is None:
+        next_page = tree.css_first(_NEXT_SEL)
+    if next_page is not None and next_page.attributes.get("href"):
+        data["next_page"] = _join(base, next_page.attributes.get("href"))
+    return data
 
 async def extract_content(url):
     """Extract meaningful content with retry and pagination."""
-    async with aiohttp.ClientSession() as session:
-        for attempt in range(3):
-            try:
-                async with session.get(url, timeout=10) as response:
-                    response.raise_for_status()
-                    soup = BeautifulSoup(await response.text(), 'html.parser')
-                    data = {
-                        "titles": [tag.get_text().strip() for tag in soup.find_all(['h1', 'h2', 'h3'])][:10],
-                        "descriptions": [meta.get("content", "") for meta in soup.find_all("meta", attrs={"name": "description"})],
-                        "links": [urljoin(url, a.get("href")) for a in soup.find_all("a", href=True)][:50],
-                        "next_page": None
-                    }
-                    next_page = soup.find("a", string="Next") or soup.find("a", attrs={"rel": "next"})
-                    if next_page and next_page.get("href"):
-                        data["next_page"] = urljoin(url, next_page.get("href"))
-                    return data
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1} failed for {url}: {e}")
-                if attempt == 2:
-                    return {"error": f"Extraction failed: {e}"}
-                await asyncio.sleep(2 ** attempt)
+    try:
+        _, html, _ = await _fetch_static(url)
+    except Exception as e:
+        return {"error": f"Extraction failed: {e}"}
+    return extract_content_from_html(url, html)
+
+def _static_js_verdict(html, tree=None):
+    """Classify a page as JS-heavy from its static HTML alone.
+
+    Returns True or False when the markup is conclusive, or None when the
+    page has to be rendered to tell. ``tree`` is an already parsed
+    LexborHTMLParser of ``html``; scripts and styles are stripped from it.
+    """
+    if tree is None:
+        tree = LexborHTMLParser(html)
+    script_ratio = sum(len(node.text()) for node in tree.css(_SCRIPT_SEL)) / max(len(html), 1)
+    # An empty mount point is the usual sign of a client-side rendered app
+    spa_root = any(len(node.text(strip=True)) < 2048 for node in tree.css(_SPA_ROOT_SEL))
+    if script_ratio > 0.4 or spa_root:
+        return True
+    tree.strip_tags(['script', 'style'])
+    text = tree.body.text(strip=True) if tree.body is not None else ""
+    if script_ratio < 0.05 and len(text) >= 200:
+        return False
+    return None
 
-async def check_js_and_api(url):
-    """Check for JS-heavy content and APIs."""
+async def _probe_api(endpoint):
+    """Return True if the endpoint answers with JSON."""
+    try:
+        async with _request("GET", endpoint, timeout=5) as response:
+            return response.status == 200 and "application/json" in response.headers.get("Content-Type", "")
+    except Exception:
+        return False
+
+def _discover_feeds(base, tree):
+    """Return RSS/Atom feed URLs advertised by the page's <link rel="alternate"> tags."""
+    return [
+        _join(base, node.attributes.get("href"))
+        for node in tree.css(_FEED_LINK_SEL)
+        if (node.attributes.get("type") or "").lower() in _FEED_TYPES
+    ]
+
+async def _probe_feed(feed_url):
+    """Return True if the URL serves a feed with entries."""
+    try:
+        async with _request("HEAD", feed_url, timeout=5, allow_redirects=True) as response:
+            # Servers that do not support HEAD are left to the GET below
+            head_unsupported = response.status in (405, 501)
+            if not head_unsupported and (response.status != 200 or "xml" not in response.headers.get("Content-Type", "")):
+                return False
+        async with _request("GET", feed_url, timeout=10) as response:
+            body = await _read_capped(response)
+        # feedparser is synchronous; keep its XML parsing off the event loop
+        feed = await asyncio.to_thread(feedparser.parse, body)
+        return bool(feed.entries)
+    except Exception:
+        return False
+
+# Default for check_js_and_api when the caller has not fetched the static page
+_NOT_FETCHED = object()
+
+async def check_js_and_api(url, static_html=_NOT_FETCHED):
+    """Check for JS-heavy content and APIs.
+
+    ``static_html`` is the page as served without JavaScript. It is fetched
+    here only when the caller has not tried to; ``None`` means that fetch
+    failed, and the JS check is skipped.
+    """
     result = {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+    base = urlsplit(url)
+    feed_urls = [_join(base, "/rss")]
     
-    # Check JavaScript-heavy content
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
+    if static_html is _NOT_FETCHED:
+        try:
+            _, static_html, _ = await _fetch_static(url)
+        except Exception as e:
+            logger.error(f"Static fetch failed for {url}: {e}")
+            static_html = None
+    
+    # Check JavaScript-heavy content, rendering with Playwright only when the static HTML is inconclusive
+    if static_html is not None:
+        tree = LexborHTMLParser(static_html)
+        feed_urls = list(dict.fromkeys(_discover_feeds(base, tree) + feed_urls))
+        verdict = _static_js_verdict(static_html, tree)
+        if verdict is not None:
+            result["is_js_heavy"] = verdict
+        else:
             try:
-                await page.goto(url, timeout=30000)
-                content_with_js = await page.content()
-                await browser.close()
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, timeout=10) as response:
-                        content_without_js = await response.text()
-                        result["is_js_heavy"] = len(content_with_js) > len(content_without_js) * 1.5
+                browser = await _get_browser()
+                async with _shared().pw_sem:
+                    context = await browser.new_context()
+                    try:
+                        page = await context.new_page()
+                        await _throttle(url)
+                        await page.goto(url, timeout=30000)
+                        content_with_js = await page.content()
+                        result["is_js_heavy"] = len(content_with_js) > len(static_html) * 1.5
+                    except Exception as e:
+                        logger.error(f"JS check failed: {e}")
+                        result["is_js_heavy"] = False
+                    finally:
+                        await context.close()
             except Exception as e:
-                logger.error(f"JS check failed: {e}")
+                logger.error(f"Playwright failed: {e}")
                 result["is_js_heavy"] = False
-    except Exception as e:
-        logger.error(f"Playwright failed: {e}")
-        result["is_js_heavy"] = False
-    
-    # Check RSS feeds
-    rss_url = urljoin(url, "/rss")
-    feed = feedparser.parse(rss_url)
-    if feed.entries:
-        result["rss_feeds"].append(rss_url)
     
-    # Check API endpoints
+    # Check RSS feeds and API endpoints; each probe waits out the crawl delay, so slow hosts skip them
+    if _shared().host_delay.get(base.netloc, 0) > PROBE_DELAY_LIMIT:
+        logger.info(f"Skipping feed and API probes for {url}: crawl delay too long")
+        return result
     api_paths = ["/api", "/v1/api", "/json"]
-    async with aiohttp.ClientSession() as session:
-        for path in api_paths:
-            try:
-                async with session.get(urljoin(url, path), timeout=5) as response:
-                    if response.status == 200 and "application/json" in response.headers.get("Content-Type", ""):
-                        result["api_detected"] = True
-                        break
-            except:
-                continue
+    feed_hits, api_hits = await asyncio.gather(
+        asyncio.gather(*[_probe_feed(feed_url) for feed_url in feed_urls]),
+        asyncio.gather(*[_probe_api(_join(base, path)) for path in api_paths])
+    )
+    result["rss_feeds"] = [feed_url for feed_url, hit in zip(feed_urls, feed_hits) if hit]
+    result["api_detected"] = any(api_hits)
     
     return result
 
-def store_data(url, robots_data, content_data, js_api_data):
-    """Store crawled data in SQLite database."""
-    conn = sqlite3.connect('crawled_data.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO crawl_results (
-        url, timestamp, titles, descriptions, links, can_crawl, crawl_delay, sitemap_urls,
-        is_js_heavy, api_detected, rss_feeds
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (
+_INSERT_CRAWL_RESULT = '''INSERT INTO crawl_results (
+    url, timestamp, titles, descriptions, links, can_crawl, crawl_delay, sitemap_urls,
+    is_js_heavy, api_detected, rss_feeds, error, disallowed_paths, next_page, robots_error
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+def _crawl_error(robots_data, content_data):
+    """Return the error that made a crawl incomplete, or None if it succeeded."""
+    if "error" in content_data:
+        return content_data["error"]
+    if robots_data.get("error", _NO_ROBOTS) != _NO_ROBOTS:
+        return robots_data["error"]
+    return None
+
+def _crawl_row(url, robots_data, content_data, js_api_data):
+    """Build the crawl_results row for one analyzed URL, with list columns as JSON."""
+    return (
         url,
         datetime.now().isoformat(),
-        str(content_data.get("titles", [])),
-        str(content_data.get("descriptions", [])),
-        str(content_data.get("links", [])),
+        json.dumps(content_data.get("titles", []), ensure_ascii=False),
+        json.dumps(content_data.get("descriptions", []), ensure_ascii=False),
+        json.dumps(content_data.get("links", []), ensure_ascii=False),
         robots_data.get("can_crawl", False),
         robots_data.get("crawl_delay", "Unknown"),
-        str(robots_data.get("sitemap_urls", [])),
+        json.dumps(robots_data.get("sitemap_urls", []), ensure_ascii=False),
         js_api_data.get("is_js_heavy", False),
         js_api_data.get("api_detected", False),
-        str(js_api_data.get("rss_feeds", []))
-    ))
-    conn.commit()
-    conn.close()
+        json.dumps(js_api_data.get("rss_feeds", []), ensure_ascii=False),
+        _crawl_error(robots_data, content_data),
+        None if "error" in robots_data else json.dumps(robots_data.get("disallowed_paths", []), ensure_ascii=False),
+        content_data.get("next_page"),
+        robots_data.get("error")
+    )
+
+def store_results(results):
+    """Store (url, robots_data, content_data, js_api_data) tuples in one transaction."""
+    rows = [_crawl_row(*result) for result in results]
+    with get_db() as conn:
+        conn.executemany(_INSERT_CRAWL_RESULT, rows)
+
+def store_data(url, robots_data, content_data, js_api_data):
+    """Store crawled data in SQLite database."""
+    store_results([(url, robots_data, content_data, js_api_data)])
+
+def export_csv(url):
+    """Return every stored analysis of url as CSV text."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    cursor = get_db().execute("SELECT * FROM crawl_results WHERE url = ?", (url,))
+    writer.writerow([column[0] for column in cursor.description])
+    writer.writerows(cursor)
+    return buffer.getvalue()
+
+def load_recent(url, max_age=CACHE_TTL):
+    """Return the latest stored analysis of url younger than max_age seconds, or None.
+
+    The result has the same keys as a fresh analyze_website result. Crawls
+    that failed are stored for the CSV export but never reused.
+    """
+    cutoff = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+    row = get_db().execute('''SELECT titles, descriptions, links, can_crawl, crawl_delay, sitemap_urls,
+        is_js_heavy, api_detected, rss_feeds, disallowed_paths, next_page, robots_error, error FROM crawl_results
+        WHERE url = ? AND timestamp > ? ORDER BY timestamp DESC LIMIT 1''', (url, cutoff)).fetchone()
+    if row is None or row[-1] is not None:
+        return None
+    (titles, descriptions, links, can_crawl, crawl_delay, sitemap_urls, is_js_heavy, api_detected, rss_feeds,
+     disallowed_paths, next_page, robots_error, _) = row
+    if disallowed_paths is None and robots_error is None:
+        # Rows written before robots.txt details were stored
+        return None
+    try:
+        if robots_error is not None:
+            robots_data = {"error": robots_error}
+        else:
+            robots_data = {
+                "can_crawl": bool(can_crawl),
+                # The TEXT column turns the parser's integer delay into a string
+                "crawl_delay": int(crawl_delay) if crawl_delay.isdigit() else crawl_delay,
+                "sitemap_urls": json.loads(sitemap_urls),
+                "disallowed_paths": json.loads(disallowed_paths)
+            }
+        content_data = {"titles": json.loads(titles), "descriptions": json.loads(descriptions), "links": json.loads(links), "next_page": next_page}
+        js_api_data = {"is_js_heavy": bool(is_js_heavy), "api_detected": bool(api_detected), "rss_feeds": json.loads(rss_feeds)}
+    except json.JSONDecodeError:
+        # Rows written before list columns were stored as JSON
+        return None
+    return robots_data, content_data, js_api_data
+
+async def analyze_website(url, max_age=CACHE_TTL):
+    """Main function to analyze website concurrently.
 
-async def analyze_website(url):
-    """Main function to analyze website concurrently."""
+    A stored analysis of the same URL younger than ``max_age`` seconds is
+    returned as is; pass ``max_age=0`` to force a fresh crawl.
+    """
     init_db()
-    tasks = [
-        analyze_robots_txt(url),
-        extract_content(url),
-        check_js_and_api(url)
-    ]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    if max_age > 0:
+        cached = load_recent(url, max_age)
+        if cached is not None:
+            logger.info(f"Using stored analysis for {url}")
+            return cached
+    robots_task = asyncio.ensure_future(analyze_robots_txt(url))
+    
+    # Fetch the static page once and share it between content extraction and the JS check
+    static_html = None
+    try:
+        _, static_html, _ = await _fetch_static(url)
+        content_data = extract_content_from_html(url, static_html)
+    except Exception as e:
+        content_data = {"error": f"Extraction failed: {e}"}
+    
+    results = await asyncio.gather(robots_task, check_js_and_api(url, static_html), return_exceptions=True)
     
     # Handle exceptions and ensure dictionary return
     robots_data = results[0] if isinstance(results[0], dict) else {"error": str(results[0])}
-    content_data = results[1] if isinstance(results[1], dict) else {"error": str(results[1])}
-    js_api_data = results[2] if isinstance(results[2], dict) else {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+    js_api_data = results[1] if isinstance(results[1], dict) else {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
     
     store_data(url, robots_data, content_data, js_api_data)
     return robots_data, content_data, js_api_data
 
+def _stop_loop(loop):
+    """Release the shared session and browser, then stop the background loop."""
+    if not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_resources(), loop).result(timeout=10)
+    except Exception as e:
+        logger.warning(f"Failed to close shared resources: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+@st.cache_resource
+def get_loop():
+    """Return the event loop analyses run on, kept alive for the whole process.
+
+    A single long-lived loop lets the shared aiohttp session and Playwright
+    browser outlive individual runs instead of dying with asyncio.run.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="crawler-loop", daemon=True).start()
+    atexit.register(_stop_loop, loop)
+    return loop
+
+def run_analysis(url):
+    """Synchronous entry point for the dashboard.
+
+    Repeat analyses within CACHE_TTL are served by analyze_website from the
+    database, which never reuses failed crawls.
+    """
+    future = asyncio.run_coroutine_threadsafe(analyze_website(url), get_loop())
+    try:
+        return future.result(timeout=ANALYSIS_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
 def main():
     """Streamlit dashboard with modern GUI."""
     st.set_page_config(page_title="Web Crawler & Analyzer", layout="wide", page_icon="🌐")
@@ -190,7 +626,7 @@ def main():
     if submit:
         with st.spinner("Crawling and analyzing..."):
             try:
-                robots_data, content_data, js_api_data = asyncio.run(analyze_website(url))
+                robots_data, content_data, js_api_data = run_analysis(url)
             except Exception as e:
                 st.error(f"Analysis failed: {e}")
                 logger.error(f"Analysis error: {e}")
@@ -220,11 +656,10 @@ def main():
             with tabs[2]:
                 links = content_data.get("links", [])
                 if links:
-                    df = pd.DataFrame({"Links": links})
-                    fig = px.histogram(df, x="Links", title="Link Distribution", nbins=20,
-                                     color_discrete_sequence=["#4CAF50"])
-                    fig.update_layout(xaxis_title="Links", yaxis_title="Count", showlegend=False)
-                    st.plotly_chart(fig, use_container_width=True)
+                    netlocs = Counter(urlsplit(link).netloc for link in links)
+                    st.write("**Linked Domains**")
+                    st.bar_chart(pd.Series(netlocs, name="Links"), color="#4CAF50")
+                    st.dataframe(pd.DataFrame({"Links": links}), use_container_width=True, hide_index=True)
                 else:
                     st.write("No links found.")
         
@@ -257,12 +692,9 @@ def main():
         
         # Data Download
         st.subheader("Download Data", anchor="download")
-        conn = sqlite3.connect('crawled_data.db')
-        df = pd.read_sql_query("SELECT * FROM crawl_results WHERE url = ?", conn, params=(url,))
-        conn.close()
         st.download_button(
             label="Download Crawled Data (CSV)",
-            data=df.to_csv(index=False),
+            data=export_csv(url),
             file_name=f"crawled_data_{url.replace('https://', '').replace('/', '_')}.csv",
             mime="text/csv",
             help="Download the analysis results as a CSV file."
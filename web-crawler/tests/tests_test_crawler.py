@@ -1,6 +1,11 @@
 import pytest
 import asyncio
-from crawler import analyze_robots_txt, extract_content
+import contextlib
+import sqlite3
+from types import SimpleNamespace
+import aiohttp
+import crawler
+from crawler import analyze_robots_txt, extract_content, extract_content_from_html, _static_js_verdict
 
 @pytest.mark.asyncio
 async def test_robots_txt():
@@ -8,8 +13,292 @@ async def test_robots_txt():
     assert isinstance(result, dict)
     assert "can_crawl" in result or "error" in result
 
+@pytest.fixture
+def shared(monkeypatch):
+    state = crawler._shared.__wrapped__()
+    monkeypatch.setattr(crawler, "_shared", lambda: state)
+    return state
+
+@pytest.mark.asyncio
+async def test_concurrent_checks_launch_one_browser(shared, monkeypatch):
+    launches = []
+
+    async def launch(**kwargs):
+        await asyncio.sleep(0.01)
+        browser = SimpleNamespace(is_connected=lambda: True)
+        launches.append(browser)
+        return browser
+
+    async def start():
+        return SimpleNamespace(chromium=SimpleNamespace(launch=launch))
+
+    monkeypatch.setattr(crawler, "async_playwright", lambda: SimpleNamespace(start=start))
+    browsers = await asyncio.gather(*[crawler._get_browser() for _ in range(3)])
+    assert len(launches) == 1
+    assert all(browser is launches[0] for browser in browsers)
+
+def _response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+def test_only_transient_fetch_errors_are_retried():
+    assert not crawler._is_transient(_response_error(404))
+    assert not crawler._is_transient(_response_error(403))
+    assert crawler._is_transient(_response_error(429))
+    assert crawler._is_transient(_response_error(503))
+    assert crawler._is_transient(aiohttp.ClientConnectionError())
+    assert crawler._is_transient(asyncio.TimeoutError())
+    assert not crawler._is_transient(ValueError())
+    assert not crawler._is_transient(aiohttp.InvalidURL("example.com"))
+
+@pytest.mark.asyncio
+async def test_fetch_static_gives_up_on_404(monkeypatch):
+    calls = []
+
+    @contextlib.asynccontextmanager
+    async def request(method, url, **kwargs):
+        calls.append(url)
+        raise _response_error(404)
+        yield
+
+    monkeypatch.setattr(crawler, "_request", request)
+    with pytest.raises(aiohttp.ClientResponseError):
+        await crawler._fetch_static("https://example.com/missing")
+    assert len(calls) == 1
+
+class _FakeBody:
+    def __init__(self, data):
+        self._data = data
+
+    async def iter_chunked(self, size):
+        yield self._data
+
+class _FakeResponse:
+    def __init__(self, status, body=b"", content_type="text/html"):
+        self.status = status
+        self.headers = {"Content-Type": content_type}
+        self.charset = None
+        self.content = _FakeBody(body)
+
+    async def text(self):
+        return self.content._data.decode()
+
+def _fake_request(responses, calls=None):
+    @contextlib.asynccontextmanager
+    async def request(method, url, **kwargs):
+        if calls is not None:
+            calls.append((method, url))
+        yield responses[(method, url)]
+    return request
+
+_RSS = b'<?xml version="1.0"?><rss version="2.0"><channel><title>t</title><item><title>i</title></item></channel></rss>'
+
+def test_decode_body_honors_meta_charset():
+    title = "Привет, мир"
+    for meta in ('<meta charset="windows-1251">', '<meta http-equiv="Content-Type" content="text/html; charset=windows-1251">'):
+        body = f"<html><head>{meta}</head><body><h1>{title}</h1></body></html>".encode("windows-1251")
+        html = crawler._decode_body(_FakeResponse(200), body)
+        assert extract_content_from_html("https://example.com/", html)["titles"] == [title]
+    body = "<h1>Café</h1>".encode("latin-1")
+    assert crawler._decode_body(_FakeResponse(200), b'<meta charset="latin-1">' + body).endswith("<h1>Café</h1>")
+    response = _FakeResponse(200)
+    response.charset = "utf-8"
+    assert crawler._decode_body(response, b'<meta charset="latin-1"><h1>Caf\xc3\xa9</h1>').endswith("<h1>Café</h1>")
+
+@pytest.mark.asyncio
+async def test_feed_probe_falls_back_to_get_when_head_is_rejected(monkeypatch):
+    feed_url = "https://example.com/rss"
+    for status in (405, 501):
+        monkeypatch.setattr(crawler, "_request", _fake_request({
+            ("HEAD", feed_url): _FakeResponse(status),
+            ("GET", feed_url): _FakeResponse(200, _RSS, "application/rss+xml")
+        }))
+        assert await crawler._probe_feed(feed_url) is True
+    monkeypatch.setattr(crawler, "_request", _fake_request({("HEAD", feed_url): _FakeResponse(404)}))
+    assert await crawler._probe_feed(feed_url) is False
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(crawler, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+_ROBOTS_TXT = _FakeResponse(200, b"User-agent: *\nDisallow: /private\nCrawl-delay: 5\n")
+
+@pytest.mark.asyncio
+async def test_robots_reused_within_ttl(shared, clock, monkeypatch):
+    calls = []
+    monkeypatch.setattr(crawler, "_request", _fake_request({("GET", "https://example.com/robots.txt"): _ROBOTS_TXT}, calls))
+    first = await analyze_robots_txt("https://example.com/")
+    shared.host_delay.clear()
+    clock[0] += crawler.ROBOTS_TTL - 1
+    assert await analyze_robots_txt("https://example.com/") == first
+    assert len(calls) == 1
+    # The crawl delay is recorded again from the cached parser
+    assert shared.host_delay == {"example.com": 5.0}
+    clock[0] += 2
+    await analyze_robots_txt("https://example.com/")
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_missing_robots_is_cached(shared, clock, monkeypatch):
+    calls = []
+    monkeypatch.setattr(crawler, "_request", _fake_request({("GET", "https://example.com/robots.txt"): _FakeResponse(404)}, calls))
+    for _ in range(2):
+        assert await analyze_robots_txt("https://example.com/") == {"error": "No robots.txt found"}
+    assert len(calls) == 1
+    clock[0] += crawler.ROBOTS_TTL
+    await analyze_robots_txt("https://example.com/")
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_robots_cache_evicts_oldest_host(shared, clock, monkeypatch):
+    for i in range(1024):
+        shared.robots[f"host{i}.test"] = (crawler._parse_robots(""), clock[0])
+    monkeypatch.setattr(crawler, "_request", _fake_request({("GET", "https://example.com/robots.txt"): _ROBOTS_TXT}))
+    await analyze_robots_txt("https://example.com/")
+    assert len(shared.robots) == 1024
+    assert "host0.test" not in shared.robots
+    assert "example.com" in shared.robots
+
+@pytest.mark.asyncio
+async def test_throttle_spaces_requests_by_crawl_delay(shared, clock, monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    shared.host_delay["slow.test"] = 2.0
+    for _ in range(3):
+        await crawler._throttle("https://slow.test/page")
+    await crawler._throttle("https://fast.test/page")
+    assert sleeps == [2.0, 4.0]
+
+@pytest.mark.asyncio
+async def test_long_crawl_delay_is_capped_and_skips_probes(shared, clock, monkeypatch):
+    calls = []
+    monkeypatch.setattr(crawler, "_request", _fake_request({
+        ("GET", "https://example.com/robots.txt"): _FakeResponse(200, b"User-agent: *\nCrawl-delay: 60\n")
+    }, calls))
+    result = await analyze_robots_txt("https://example.com/")
+    assert result["crawl_delay"] == 60
+    assert shared.host_delay == {"example.com": crawler.MAX_CRAWL_DELAY}
+    html = "<html><body><p>" + "Server rendered text. " * 20 + "</p></body></html>"
+    assert await crawler.check_js_and_api("https://example.com/", html) == {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+    assert calls == [("GET", "https://example.com/robots.txt")]
+
+def test_export_csv_matches_pandas(monkeypatch):
+    import pandas as pd
+    conn = sqlite3.connect(":memory:")
+    monkeypatch.setattr(crawler, "get_db", lambda: conn)
+    crawler.init_db()
+    js_api_data = {"is_js_heavy": True, "api_detected": False, "rss_feeds": ["https://example.com/rss"]}
+    crawler.store_data("https://example.com", {"can_crawl": True, "crawl_delay": 5}, {"titles": ['A "quoted", title'], "links": []}, js_api_data)
+    crawler.store_data("https://example.com", {"error": "No robots.txt found"}, {"error": "Extraction failed: 404"}, js_api_data)
+    expected = pd.read_sql_query("SELECT * FROM crawl_results WHERE url = ?", conn, params=("https://example.com",)).to_csv(index=False)
+    assert crawler.export_csv("https://example.com") == expected
+
+def test_robots_disallowed_paths():
+    parser = crawler._parse_robots("User-agent: *\nDisallow: /private\nAllow: /public\nDisallow:\n\nUser-agent: bot\nDisallow: /")
+    assert crawler._disallowed_paths(parser) == ["/private"]
+
 @pytest.mark.asyncio
 async def test_content_extraction():
     result = await extract_content("https://example.com")
     assert isinstance(result, dict)
-    assert "titles" in result or "error" in result
\ No newline at end of file
+    assert "titles" in result or "error" in result
+
+def test_content_extraction_from_html():
+    html = """<html><head><meta name="description" content="A test page"></head>
+    <body><h1>Main</h1><h2>Sub</h2><a href="/about">About</a><a href="/page/2" rel="next">Next</a></body></html>"""
+    result = extract_content_from_html("https://example.com/", html)
+    assert result["titles"] == ["Main", "Sub"]
+    assert result["descriptions"] == ["A test page"]
+    assert result["links"] == ["https://example.com/about", "https://example.com/page/2"]
+    assert result["next_page"] == "https://example.com/page/2"
+
+def test_content_extraction_keeps_inline_spacing():
+    html = '<h1>Hello <b>World</b> again</h1><a href="/p2"><span>Next</span> </a>'
+    result = extract_content_from_html("https://example.com/", html)
+    assert result["titles"] == ["Hello World again"]
+    assert result["next_page"] == "https://example.com/p2"
+
+def test_join_matches_urljoin():
+    from urllib.parse import urljoin, urlsplit
+    base_url = "https://example.com/docs/page?x=1"
+    for href in ["https://other.test/a/../b", "/about", "/a/./b", "//cdn.test/x", "next", "../up", "?page=2", "#top"]:
+        assert crawler._join(urlsplit(base_url), href) == urljoin(base_url, href)
+
+def test_static_js_verdict():
+    assert _static_js_verdict('<html><body><div id="root"></div><script src="/app.js"></script></body></html>') is True
+    assert _static_js_verdict("<html><body><p>" + "Server rendered text. " * 20 + "</p></body></html>") is False
+    assert _static_js_verdict("<html><body><p>" + "x" * 600 + "</p><script>" + "y" * 100 + "</script></body></html>") is None
+
+def test_stored_analysis_roundtrip(monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    monkeypatch.setattr(crawler, "get_db", lambda: conn)
+    crawler.init_db()
+    robots_data = {"can_crawl": True, "crawl_delay": "Not specified", "sitemap_urls": ["https://example.com/sitemap.xml"], "disallowed_paths": ["/private"]}
+    content_data = {"titles": ["It's \"quoted\""], "descriptions": [], "links": ["https://example.com/a"], "next_page": None}
+    js_api_data = {"is_js_heavy": False, "api_detected": True, "rss_feeds": []}
+    crawler.store_data("https://example.com", robots_data, content_data, js_api_data)
+    assert crawler.load_recent("https://example.com") == (robots_data, content_data, js_api_data)
+    assert crawler.load_recent("https://example.org") is None
+
+@pytest.mark.asyncio
+async def test_stored_analysis_matches_fresh_one(shared, monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    monkeypatch.setattr(crawler, "get_db", lambda: conn)
+    crawler.init_db()
+    html = '<html><body><h1>Main</h1><a href="/page/2" rel="next">Next</a></body></html>'
+    js_api_data = {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+    for url, robots in [
+        ("https://example.com/", _FakeResponse(200, b"User-agent: *\nDisallow: /private\nCrawl-delay: 5\nSitemap: https://example.com/s.xml\n")),
+        ("https://example.org/", _FakeResponse(404))
+    ]:
+        monkeypatch.setattr(crawler, "_request", _fake_request({("GET", url + "robots.txt"): robots}))
+        fresh = (await analyze_robots_txt(url), extract_content_from_html(url, html), js_api_data)
+        crawler.store_data(url, *fresh)
+        assert crawler.load_recent(url) == fresh
+
+def test_failed_crawl_is_not_reused(monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    monkeypatch.setattr(crawler, "get_db", lambda: conn)
+    crawler.init_db()
+    js_api_data = {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+    crawler.store_data("https://down.test", {"error": "Failed to parse robots.txt: timeout"}, {"titles": []}, js_api_data)
+    crawler.store_data("https://gone.test", {"error": "No robots.txt found"}, {"error": "Extraction failed: 404"}, js_api_data)
+    assert crawler.load_recent("https://down.test") is None
+    assert crawler.load_recent("https://gone.test") is None
+    # A site without robots.txt still answered, so its analysis is reused
+    crawler.store_data("https://plain.test", {"error": "No robots.txt found"}, {"titles": ["Hi"]}, js_api_data)
+    assert crawler.load_recent("https://plain.test") is not None
+
+def test_run_analysis_retries_failed_crawls(monkeypatch):
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    monkeypatch.setattr(crawler, "get_db", lambda: conn)
+    fetches = []
+    html = "<html><body><h1>Up</h1></body></html>"
+
+    async def fetch_static(url):
+        fetches.append(url)
+        if len(fetches) <= 2:
+            raise aiohttp.ClientConnectionError("connection refused")
+        return 200, html, {}
+
+    async def robots(url):
+        return {"error": "Failed to parse robots.txt: connection refused"} if len(fetches) <= 2 else {"error": "No robots.txt found"}
+
+    async def js_and_api(url, static_html):
+        return {"is_js_heavy": False, "api_detected": False, "rss_feeds": []}
+
+    monkeypatch.setattr(crawler, "_fetch_static", fetch_static)
+    monkeypatch.setattr(crawler, "analyze_robots_txt", robots)
+    monkeypatch.setattr(crawler, "check_js_and_api", js_and_api)
+    for _ in range(2):
+        assert "error" in crawler.run_analysis("https://down.test")[1]
+    assert len(fetches) == 2
+    # Once the site is back its analysis is crawled again, then reused
+    assert crawler.run_analysis("https://down.test")[1]["titles"] == ["Up"]
+    assert crawler.run_analysis("https://down.test")[1]["titles"] == ["Up"]
+    assert len(fetches) == 3